@@ -1,137 +1,271 @@
 import boto3
+import botocore.config
 import json
 import datetime
+import concurrent.futures
+import hashlib
 import os
+import time
 import traceback
+from decimal import Decimal, ROUND_HALF_UP
 from dateutil.relativedelta import relativedelta
 
 # Conversion rate (1 USD = X INR)
 USD_TO_INR_RATE = 83  # Update with current rate if necessary
+INR_PAISE_PER_USD = Decimal(str(USD_TO_INR_RATE)) * 100
 
-def get_cost_and_usage(client, start_date_str, end_date_str):
+MONTH_NAMES = (
+    'January', 'February', 'March', 'April', 'May', 'June',
+    'July', 'August', 'September', 'October', 'November', 'December'
+)
+
+# Table row markup: serial number, account, month, formatted USD and INR costs
+ROW_TEMPLATE = "<tr><td>%d</td><td>%s</td><td>%s</td><td>$%s</td><td>₹%s</td></tr>"
+
+# Cost Explorer data refreshes at most hourly, so let browsers and edge caches reuse the page
+HTML_CACHE_CONTROL = 'public, max-age=3600, stale-while-revalidate=600'
+
+# AWS clients are created once per container and reused across warm invocations,
+# with short timeouts and bounded retries so a stalled call fails well inside the
+# 30 s Lambda timeout and the handler can still return its error response
+AWS_CLIENT_CONFIG = botocore.config.Config(
+    retries={'max_attempts': 2, 'mode': 'standard'},
+    connect_timeout=1.5,
+    read_timeout=5,
+    max_pool_connections=10,
+    tcp_keepalive=True
+)
+# Cost Explorer is slow to answer, so it gets a longer read timeout but no retry
+CE_CLIENT = boto3.client('ce', config=AWS_CLIENT_CONFIG.merge(botocore.config.Config(
+    retries={'max_attempts': 1, 'mode': 'standard'},
+    read_timeout=15
+)))
+S3_CLIENT = boto3.client('s3', config=AWS_CLIENT_CONFIG)
+# The template ETag probe is best-effort, so it is never retried
+S3_PROBE_CLIENT = boto3.client('s3', config=AWS_CLIENT_CONFIG.merge(
+    botocore.config.Config(retries={'max_attempts': 1, 'mode': 'standard'})
+))
+
+# Worker thread used to fetch the HTML template while Cost Explorer is queried
+TEMPLATE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+# Seconds to trust the cached HTML template before revalidating its ETag
+TEMPLATE_CACHE_TTL_SECONDS = 300
+_TEMPLATE_CACHE = {'key': None, 'etag': None, 'body': None, 'checked_at': 0.0}
+
+# Seconds to serve a rendered page again for the same date range and template
+RENDER_CACHE_TTL_SECONDS = 300
+_RENDER_CACHE = {'range': None, 'template_etag': None, 'html': None, 'etag': None, 'rendered_at': 0.0}
+
+# Report date range only changes when the day does
+_DATE_RANGE_CACHE = {'day': None, 'range': None}
+
+def iter_cost_and_usage(client, start_date_str, end_date_str, group_key='LINKED_ACCOUNT'):
     """
-    Fetch cost and usage data from AWS Cost Explorer with account grouping
+    Fetch cost and usage data from AWS Cost Explorer grouped by the given
+    dimension, following NextPageToken until every page has been read
     """
     try:
-        return client.get_cost_and_usage(
-            TimePeriod={
+        request = {
+            'TimePeriod': {
                 'Start': start_date_str,
                 'End': end_date_str
             },
-            Granularity='MONTHLY',
-            Metrics=['UnblendedCost'],
-            GroupBy=[
-                {'Type': 'DIMENSION', 'Key': 'LINKED_ACCOUNT'}
-            ]
-        )
+            'Granularity': 'MONTHLY',
+            'Metrics': ['UnblendedCost'],
+            'GroupBy': [
+                {'Type': 'DIMENSION', 'Key': group_key}
+            ],
+            # Credits and refunds are not usage; leaving them out shrinks the response
+            'Filter': {
+                'Not': {
+                    'Dimensions': {'Key': 'RECORD_TYPE', 'Values': ['Credit', 'Refund']}
+                }
+            }
+        }
+        while True:
+            response = client.get_cost_and_usage(**request)
+            yield from response['ResultsByTime']
+            
+            token = response.get('NextPageToken')
+            if not token:
+                break
+            request['NextPageToken'] = token
     except Exception as e:
         print(f"Error fetching cost and usage data: {str(e)}")
         raise
 
-def process_billing_data(response):
+def format_minor_units(amount):
+    """
+    Format an integer amount of cents/paise as a two-decimal string
+    """
+    sign = '-' if amount < 0 else ''
+    whole, fraction = divmod(abs(amount), 100)
+    return f"{sign}{whole}.{fraction:02d}"
+
+def render_rows_and_totals(results):
     """
-    Process the Cost Explorer response into formatted billing data
+    Render the Cost Explorer results into HTML table rows, accumulating the
+    USD and INR totals in the same pass (tracked in whole cents and paise,
+    rounded half-up from the exact Cost Explorer amount)
     """
-    billing_data = []
+    rows = []
+    append = rows.append
+    total_usd_cents = 0
+    total_inr_paise = 0
     sl_no = 1
+    month_periods = {}
     
     try:
-        for result in response['ResultsByTime']:
-            month_period = datetime.datetime.strptime(
-                result['TimePeriod']['Start'], '%Y-%m-%d'
-            ).strftime('%B %Y')
+        for result in results:
+            # Cost Explorer dates are always YYYY-MM-DD, so format '%B %Y' by slicing
+            start = result['TimePeriod']['Start']
+            month_period = month_periods.get(start)
+            if month_period is None:
+                month_period = f"{MONTH_NAMES[int(start[5:7]) - 1]} {start[:4]}"
+                month_periods[start] = month_period
             
             for group in result.get('Groups', []):
                 account_number = group['Keys'][0]
-                cost_usd = float(group['Metrics']['UnblendedCost']['Amount'])
-                cost_inr = round(cost_usd * USD_TO_INR_RATE, 2)
+                cost_usd = Decimal(group['Metrics']['UnblendedCost']['Amount'])
+                if not cost_usd:
+                    continue
+                cost_usd_cents = int((cost_usd * 100).to_integral_value(ROUND_HALF_UP))
+                cost_inr_paise = int((cost_usd * INR_PAISE_PER_USD).to_integral_value(ROUND_HALF_UP))
                 
-                billing_data.append({
-                    'sl_no': sl_no,
-                    'account_number': account_number,
-                    'month_period': month_period,
-                    'cost_usd': cost_usd,
-                    'cost_inr': cost_inr
-                })
+                append(ROW_TEMPLATE % (
+                    sl_no, account_number, month_period,
+                    format_minor_units(cost_usd_cents), format_minor_units(cost_inr_paise)
+                ))
+                total_usd_cents += cost_usd_cents
+                total_inr_paise += cost_inr_paise
                 sl_no += 1
                 
-        return billing_data
+        return ''.join(rows), total_usd_cents, total_inr_paise
     except Exception as e:
-        print(f"Error processing billing data: {str(e)}")
+        print(f"Error rendering billing rows: {str(e)}")
         raise
 
-def generate_table_rows(billing_data):
+def compile_html_template(html_template):
     """
-    Generate HTML table rows from billing data
+    Convert the template placeholders into a %-format string so the page
+    can be rendered in a single substitution pass
     """
-    try:
-        rows = ""
-        for entry in billing_data:
-            rows += f"""
-            <tr>
-                <td>{entry['sl_no']}</td>
-                <td>{entry['account_number']}</td>
-                <td>{entry['month_period']}</td>
-                <td>${entry['cost_usd']:.2f}</td>
-                <td>₹{entry['cost_inr']:.2f}</td>
-            </tr>
-            """
-        return rows
-    except Exception as e:
-        print(f"Error generating table rows: {str(e)}")
-        raise
+    return (
+        html_template.replace('%', '%%')
+        .replace('{{tableRows}}', '%(rows)s')
+        .replace('{{totalCostUSD}}', '%(usd)s')
+        .replace('{{totalCostINR}}', '%(inr)s')
+    )
 
-def get_html_template_from_s3(s3_client, bucket_name, object_key):
+def get_html_template_from_s3(s3_client, bucket_name, object_key, probe_client=None):
     """
-    Fetch the HTML template from S3
+    Fetch the HTML template from S3 and compile it, reusing the copy cached
+    in this container while its ETag is unchanged. The ETag is checked with
+    probe_client when given; if that check fails the cached copy is kept.
+    Returns the compiled template and its ETag
     """
     try:
+        cache = _TEMPLATE_CACHE
+        cache_key = (bucket_name, object_key)
+        now = time.monotonic()
+        
+        if cache['key'] == cache_key:
+            if now - cache['checked_at'] < TEMPLATE_CACHE_TTL_SECONDS:
+                return cache['body'], cache['etag']
+            
+            try:
+                head = (probe_client or s3_client).head_object(Bucket=bucket_name, Key=object_key)
+            except Exception as e:
+                print(f"Template ETag check failed, using cached copy: {str(e)}")
+                return cache['body'], cache['etag']
+            if head['ETag'] == cache['etag']:
+                cache['checked_at'] = now
+                return cache['body'], cache['etag']
+        
         response = s3_client.get_object(Bucket=bucket_name, Key=object_key)
-        return response['Body'].read().decode('utf-8')
+        body = compile_html_template(response['Body'].read().decode('utf-8'))
+        cache.update(key=cache_key, etag=response['ETag'], body=body, checked_at=now)
+        return body, response['ETag']
     except Exception as e:
         print(f"Error fetching HTML template from S3: {str(e)}")
         raise
 
+def get_date_range():
+    """
+    Return the Cost Explorer (start, end) dates covering the last 12 months
+    up to the first day of next month, recomputed once per day
+    """
+    today = datetime.date.today()
+    cache = _DATE_RANGE_CACHE
+    if cache['day'] != today:
+        end_date = (today + relativedelta(months=1)).replace(day=1)
+        start_date = end_date - relativedelta(months=12)
+        cache['range'] = (start_date.strftime('%Y-%m-01'), end_date.strftime('%Y-%m-01'))
+        cache['day'] = today
+    return cache['range']
+
 def handler(event, context):
     """
     Lambda handler function
     """
     try:
-        # Initialize AWS clients
-        ce_client = boto3.client('ce')
-        s3_client = boto3.client('s3')
-        
         # Get S3 bucket name from environment variables
         bucket_name = os.environ.get('S3_BUCKET', 'aws-billing-dashboard-4frfdktl')
         object_key = 'index.html'
         
-        # Fetch HTML template
-        html_template = get_html_template_from_s3(s3_client, bucket_name, object_key)
-        
-        # Calculate date range (first day of last 12 months to first day of current month)
-        end_date = (datetime.datetime.now() + relativedelta(months=1)).replace(day=1)
-        start_date = end_date - relativedelta(months=12)
-        
-        # Format dates for AWS Cost Explorer
-        start_date_str = start_date.strftime('%Y-%m-01')
-        end_date_str = end_date.strftime('%Y-%m-01')
-        
-        # Get cost and usage data
-        print(f"Fetching cost data from {start_date_str} to {end_date_str}")
-        response = get_cost_and_usage(ce_client, start_date_str, end_date_str)
+        # Fetch HTML template in the background while Cost Explorer is queried
+        template_future = TEMPLATE_EXECUTOR.submit(
+            get_html_template_from_s3, S3_CLIENT, bucket_name, object_key, S3_PROBE_CLIENT
+        )
         
-        # Process billing data and generate table
-        billing_data = process_billing_data(response)
-        table_rows = generate_table_rows(billing_data)
+        # Date range for AWS Cost Explorer (first day of last 12 months to first day of next month)
+        start_date_str, end_date_str = get_date_range()
         
-        # Calculate totals
-        total_usd = sum(entry['cost_usd'] for entry in billing_data)
-        total_inr = sum(entry['cost_inr'] for entry in billing_data)
+        # Reuse a recent render of the same date range and template version
+        rendered = _RENDER_CACHE
+        if (rendered['range'] == (start_date_str, end_date_str)
+                and time.monotonic() - rendered['rendered_at'] < RENDER_CACHE_TTL_SECONDS
+                and template_future.result()[1] == rendered['template_etag']):
+            html_output, etag = rendered['html'], rendered['etag']
+        else:
+            # Get cost and usage data
+            print(f"Fetching cost data from {start_date_str} to {end_date_str}")
+            results = iter_cost_and_usage(CE_CLIENT, start_date_str, end_date_str)
+            
+            # Generate table rows and totals
+            table_rows, total_usd_cents, total_inr_paise = render_rows_and_totals(results)
+            
+            # Update HTML template
+            html_template, template_etag = template_future.result()
+            html_output = html_template % {
+                'rows': table_rows,
+                'usd': f"${format_minor_units(total_usd_cents)}",
+                'inr': f"₹{format_minor_units(total_inr_paise)}"
+            }
+            
+            etag = f'"{hashlib.md5(html_output.encode()).hexdigest()}"'
+            rendered.update(
+                range=(start_date_str, end_date_str),
+                template_etag=template_etag,
+                html=html_output,
+                etag=etag,
+                rendered_at=time.monotonic()
+            )
         
-        # Update HTML template
-        html_output = html_template.replace('{{tableRows}}', table_rows)
-        html_output = html_output.replace('{{totalCostUSD}}', f"${total_usd:.2f}")
-        html_output = html_output.replace('{{totalCostINR}}', f"₹{total_inr:.2f}")
+        # Skip the body entirely when the caller already holds this version; CloudFront
+        # weakens the ETag on responses it compresses, so ignore a W/ prefix
+        if_none_match = ((event or {}).get('headers') or {}).get('if-none-match') or ''
+        if if_none_match.removeprefix('W/') == etag:
+            return {
+                'statusCode': 304,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'ETag': etag,
+                    'Cache-Control': HTML_CACHE_CONTROL
+                },
+                'body': ''
+            }
         
         # Return success response
         return {
@@ -139,7 +273,8 @@ def handler(event, context):
             'headers': {
                 'Content-Type': 'text/html',
                 'Access-Control-Allow-Origin': '*',
-                'Cache-Control': 'no-cache'
+                'Cache-Control': HTML_CACHE_CONTROL,
+                'ETag': etag
             },
             'body': html_output
         }
@@ -147,6 +282,7 @@ def handler(event, context):
     except Exception as e:
         print(f"Error in lambda function: {str(e)}")
         print(traceback.format_exc())
+        # Details stay in the logs; the client only gets an id to correlate with them
         return {
             'statusCode': 500,
             'headers': {
@@ -155,7 +291,6 @@ def handler(event, context):
             },
             'body': json.dumps({
                 'error': 'Internal Server Error',
-                'details': str(e),
-                'trace': traceback.format_exc()
+                'request_id': getattr(context, 'aws_request_id', None)
             })
         }